@@ -1,7 +1,11 @@
 
 import json
+import re
+import threading
+import difflib
 import collections
-from typing import Dict, List, Optional, AsyncGenerator
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, AsyncGenerator, Iterator, Callable, Union
 from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger, AstrBotConfig
@@ -9,6 +13,129 @@ from astrbot.core.star.filter.command import CommandFilter
 from astrbot.core.star.filter.command_group import CommandGroupFilter
 from astrbot.core.star.star_handler import star_handlers_registry, StarHandlerMetadata
 
+try:
+    from rapidfuzz import process as fuzz_process
+    from rapidfuzz.distance import Levenshtein
+except ImportError:  # 未安装 rapidfuzz 时退回标准库 difflib
+    fuzz_process = None
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库 json
+    orjson = None
+
+
+# 不收录的插件：核心插件和自身
+_SKIP_PLUGINS = frozenset({"astrbot", "astrbot_plugin_command_query", "astrbot-reminder"})
+# 能提供指令名的过滤器类型
+_COMMAND_FILTER_TYPES = (CommandFilter, CommandGroupFilter)
+# 前缀树中标记指令结尾的键（普通节点的键都是单个字符，不会冲突）
+_TRIE_END = "__end__"
+# 描述/插件名分词：按空白和标点切分
+_TOKEN_SPLIT = re.compile(r"\W+")
+# 编辑距离匹配的最低相似度（0~1）
+_FUZZY_CUTOFF = 0.6
+# 编辑距离匹配的最短关键词长度，更短的关键词改一个字就是另一个词，只在其他匹配都落空时纠错
+_FUZZY_MIN_LEN = 3
+# 短关键词纠错的最低相似度，只差一个字的两字词（如 "钩鱼" -> "钓鱼"）为 0.5
+_FUZZY_SHORT_CUTOFF = 0.5
+# search_command 响应缓存的容量：关键词由 LLM 任意生成，按 LRU 淘汰，避免无限增长
+_SEARCH_CACHE_SIZE = 256
+# 测试指令：去掉消息开头的指令名，只保留参数
+_STRIP_SEARCH = re.compile(r"^/(?:测试指令搜索|test_search)\s*")
+_STRIP_DETAIL = re.compile(r"^/(?:测试指令详情|test_detail)\s*")
+_STRIP_PLUGINS = re.compile(r"^/(?:测试插件列表|test_plugins)\s*")
+
+
+def _dumps(obj) -> str:
+    """
+    序列化为紧凑的 JSON 字符串（保留中文），优先使用 orjson
+    响应只给 LLM 读取，不缩进、不加空格，减少输出体积
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _identity(obj):
+    """原样返回，作为默认的投影函数"""
+    return obj
+
+
+@dataclass(slots=True)
+class CommandInfo:
+    """
+    原指令条目，用 slots 数据类代替字典，属性按固定偏移读取
+    """
+    command: str
+    description: str
+    plugin: str
+    aliases: List[str]
+    # 预先转为小写，搜索时无需重复分配字符串
+    _cmd_lower: str
+    _desc_lower: str
+    _plugin_lower: str
+    # 预先替换前缀，响应时直接读取
+    _prefixed: str
+    _aliases_prefixed: List[str]
+
+
+class AliasView:
+    """
+    别名条目：只保存别名自身的字段，描述、插件名等字段通过 _base 从原指令的条目读取
+    用 __slots__ 代替字典，每个别名只占几个指针的空间
+    读取方先判断 isinstance(cmd, AliasView)，再直接读 is_alias_of 和 _base 的属性
+    """
+    __slots__ = ("_base", "command", "is_alias_of", "_cmd_lower", "_prefixed")
+    
+    def __init__(self, base: CommandInfo, command: str, prefixed: str):
+        self._base = base
+        self.command = command
+        self.is_alias_of = base.command
+        self._cmd_lower = command.lower()
+        self._prefixed = prefixed
+
+
+# 指令缓存中的条目：原指令或别名
+CommandEntry = Union[CommandInfo, AliasView]
+
+
+@dataclass(slots=True)
+class CommandSnapshot:
+    """
+    一次构建得到的指令字典及由其派生的全部索引和响应缓存
+    重建时先完整构建新快照，再用一次赋值整体替换
+    读取方每次调用只取一次快照并只读它，指令字典和索引总是来自同一次构建
+    """
+    commands: Dict[str, CommandEntry]  # 指令键 -> 条目（含别名）
+    name_trie: Dict  # 指令名前缀树
+    token_index: Dict[str, set]  # 描述/插件名分词 -> 指令集合
+    trigram_index: Dict[str, set]  # 指令名/描述/插件名的 3 字片段 -> 指令集合
+    key_order: Dict[str, int]  # 指令键 -> 在缓存中的序号，用于按缓存顺序输出候选
+    name_list: List[str]  # 指令键列表，与 name_choices 一一对应
+    name_choices: List[str]  # 小写且不带 / 的指令名，供编辑距离匹配
+    canonical_commands: List[CommandInfo]  # 所有原指令条目（不含别名），保持缓存顺序
+    plugins_index: Dict[str, List[CommandInfo]]  # 插件名 -> 指令列表（不含别名）
+    plugin_names_sorted: List[str]  # 排序后的插件名列表
+    plugin_names_lower: List[tuple]  # [(插件名, 小写插件名)]，保持插件加载顺序
+    plugin_bigram_index: Dict[str, set]  # 小写插件名的 2 字片段 -> 插件序号集合
+    # 响应缓存随快照一起替换，不会残留旧指令的结果
+    response_cache: Dict[tuple, str] = field(default_factory=dict)  # (工具名, 参数) -> 已序列化的成功响应
+    # 搜索关键词 -> 已序列化的成功响应（LRU）
+    search_response_cache: collections.OrderedDict = field(default_factory=collections.OrderedDict)
+
+
+# 固定不变的错误响应，预先序列化
+_ERR_NO_KEYWORD = _dumps({
+    "success": False,
+    "message": "缺少必需参数: keyword",
+    "results": []
+})
+_ERR_NO_COMMAND = _dumps({
+    "success": False,
+    "message": "缺少必需参数: command_name"
+})
+
 
 @register(
     "astrbot_plugin_command_query",
@@ -41,11 +168,15 @@ class CommandQueryPlugin(Star):
         """插件初始化"""
         super().__init__(context)
         self.config = config
-        self._command_cache = None  # 指令缓存
+        self._snapshot = None  # 指令缓存及其搜索索引、响应缓存，整体替换
         self._last_star_count = 0  # 上次缓存时的插件数量
         self._handler_index = None  # handler 索引缓存
+        self._build_lock = threading.Lock()  # 保证同一时间只有一个调用方重建缓存
         # 获取用户配置的指令前缀，默认为 /
         self.command_prefix = config.get("command_prefix", "/") if config else "/"
+        # 默认前缀无需替换，直接原样返回
+        if self.command_prefix == "/":
+            self._replace_prefix = _identity
         logger.info(f"指令查询插件已加载 v2.1 - 性能优化版 (指令前缀: {self.command_prefix})")
 
     def _replace_prefix(self, command: str) -> str:
@@ -72,10 +203,252 @@ class CommandQueryPlugin(Star):
         """
         handler_index = collections.defaultdict(list)
         for handler in star_handlers_registry:
-            if isinstance(handler, StarHandlerMetadata):
+            # StarHandlerMetadata 是不会被继承的数据类，精确类型比较即可
+            if type(handler) is StarHandlerMetadata:
                 handler_index[handler.handler_module_path].append(handler)
         return handler_index
     
+    def _invalidate_cache(self) -> None:
+        """清空指令缓存及由其派生的搜索索引"""
+        self._snapshot = None
+    
+    def _build_snapshot(self, commands_dict: Dict[str, CommandEntry]) -> CommandSnapshot:
+        """
+        根据指令字典构建搜索索引，与指令字典一起打包为快照
+        - 前缀树：小写指令名（去掉 /）逐字符建树，结尾节点记录指令键
+        - 倒排索引：描述/插件名分词 -> 指令键集合
+        - 3 字片段索引：指令名/描述/插件名的 3 字片段 -> 指令键集合，供子串匹配筛选候选
+        - 指令名列表：供编辑距离匹配使用
+        - 原指令列表及插件索引：插件名 -> 指令列表（均不含别名）
+        - 插件名 2 字片段索引：供插件名模糊匹配快速筛选候选
+        只构建新对象，不修改当前快照；由调用方一次赋值发布
+        
+        Args:
+            commands_dict: _build_commands 构建的指令字典
+        
+        Returns:
+            新的快照
+        """
+        name_trie = {}
+        token_index = {}
+        trigram_index = {}
+        key_order = {}
+        canonical_commands = []
+        plugins_index = {}
+        for ordinal, (cmd_key, cmd_info) in enumerate(commands_dict.items()):
+            key_order[cmd_key] = ordinal
+            node = name_trie
+            for ch in cmd_info._cmd_lower[1:]:
+                node = node.setdefault(ch, {})
+            node.setdefault(_TRIE_END, []).append(cmd_key)
+            
+            # 别名条目的描述和插件名从原指令读取
+            is_alias = isinstance(cmd_info, AliasView)
+            base = cmd_info._base if is_alias else cmd_info
+            desc_lower = base._desc_lower
+            plugin_lower = base._plugin_lower
+            for text in (desc_lower, plugin_lower):
+                for token in _TOKEN_SPLIT.split(text):
+                    if token:
+                        token_index.setdefault(token, set()).add(cmd_key)
+            
+            for text in (cmd_info._cmd_lower, desc_lower, plugin_lower):
+                for i in range(len(text) - 2):
+                    trigram_index.setdefault(text[i:i + 3], set()).add(cmd_key)
+            
+            # 跳过别名
+            if not is_alias:
+                canonical_commands.append(cmd_info)
+                plugins_index.setdefault(cmd_info.plugin, []).append(cmd_info)
+        
+        name_list = list(commands_dict.keys())
+        name_choices = [cmd_info._cmd_lower[1:] for cmd_info in commands_dict.values()]
+        plugin_names_sorted = sorted(plugins_index.keys())
+        plugin_names_lower = [
+            (pname, commands[0]._plugin_lower) for pname, commands in plugins_index.items()
+        ]
+        
+        plugin_bigram_index = {}
+        for index, (_, pname_lower) in enumerate(plugin_names_lower):
+            for i in range(len(pname_lower) - 1):
+                plugin_bigram_index.setdefault(pname_lower[i:i + 2], set()).add(index)
+        
+        return CommandSnapshot(
+            commands=commands_dict,
+            name_trie=name_trie,
+            token_index=token_index,
+            trigram_index=trigram_index,
+            key_order=key_order,
+            name_list=name_list,
+            name_choices=name_choices,
+            canonical_commands=canonical_commands,
+            plugins_index=plugins_index,
+            plugin_names_sorted=plugin_names_sorted,
+            plugin_names_lower=plugin_names_lower,
+            plugin_bigram_index=plugin_bigram_index
+        )
+    
+    def _trie_prefix_match(self, snapshot: CommandSnapshot, prefix: str) -> Iterator[str]:
+        """
+        在前缀树中查找以 prefix 开头的所有指令
+        时间复杂度: O(|prefix|) 定位 + 按需遍历子树（调用方凑够结果即可停止）
+        
+        Args:
+            snapshot: 指令快照
+            prefix: 小写且不带 / 的关键词
+        
+        Yields:
+            指令键，按层序遍历，较短的指令排在前面
+        """
+        node = snapshot.name_trie
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return
+        
+        queue = collections.deque([node])
+        while queue:
+            current = queue.popleft()
+            for ch, child in current.items():
+                if ch == _TRIE_END:
+                    yield from child
+                else:
+                    queue.append(child)
+    
+    def _match_tokens(self, snapshot: CommandSnapshot, keyword: str) -> set:
+        """
+        在倒排索引中查找描述/插件名包含关键词中所有词的指令
+        
+        Args:
+            snapshot: 指令快照
+            keyword: 小写关键词，可包含多个以空白/标点分隔的词（如 "fish bag"）
+        
+        Returns:
+            指令键集合
+        """
+        tokens = [token for token in _TOKEN_SPLIT.split(keyword) if token]
+        if not tokens:
+            return set()
+        
+        postings = []
+        for token in tokens:
+            posting = snapshot.token_index.get(token)
+            if not posting:
+                return set()
+            postings.append(posting)
+        
+        # 从最小的集合开始求交集，中间结果尽量小
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:])
+    
+    def _substring_candidates(
+        self,
+        snapshot: CommandSnapshot,
+        keyword: str
+    ) -> Optional[List[CommandEntry]]:
+        """
+        用 3 字片段索引筛选可能包含关键词的指令条目
+        包含关键词的字符串必然包含关键词的每个 3 字片段，故对各片段的命中集合求交集即可
+        
+        Args:
+            snapshot: 指令快照
+            keyword: 小写且不带 / 的关键词
+        
+        Returns:
+            候选条目列表（按缓存顺序），关键词不足 3 个字符时返回 None 表示需要全量扫描
+        """
+        if len(keyword) < 3:
+            return None
+        
+        shortlist = None
+        for i in range(len(keyword) - 2):
+            posting = snapshot.trigram_index.get(keyword[i:i + 3])
+            if not posting:
+                return []
+            shortlist = posting if shortlist is None else shortlist & posting
+            if not shortlist:
+                return []
+        
+        all_commands = snapshot.commands
+        return [all_commands[cmd_key] for cmd_key in sorted(shortlist, key=snapshot.key_order.__getitem__)]
+    
+    def _match_plugin(self, snapshot: CommandSnapshot, plugin_name: str) -> Optional[str]:
+        """
+        模糊匹配插件名：返回第一个（按加载顺序）名称包含关键词的插件
+        关键词不少于 2 个字符时，先用 2 字片段索引求交集筛选候选，再逐个校验
+        
+        Args:
+            snapshot: 指令快照
+            plugin_name: 插件名关键词
+        
+        Returns:
+            匹配到的插件名，未找到返回 None
+        """
+        plugin_name_lower = plugin_name.lower()
+        plugin_names_lower = snapshot.plugin_names_lower
+        
+        if len(plugin_name_lower) < 2:
+            candidates = range(len(plugin_names_lower))
+        else:
+            shortlist = None
+            for i in range(len(plugin_name_lower) - 1):
+                posting = snapshot.plugin_bigram_index.get(plugin_name_lower[i:i + 2])
+                if not posting:
+                    return None
+                shortlist = posting if shortlist is None else shortlist & posting
+            candidates = sorted(shortlist)
+        
+        for index in candidates:
+            pname, pname_lower = plugin_names_lower[index]
+            if plugin_name_lower in pname_lower:
+                return pname
+        return None
+    
+    def _fuzzy_name_match(
+        self,
+        snapshot: CommandSnapshot,
+        keyword: str,
+        limit: int,
+        cutoff: float
+    ) -> List[str]:
+        """
+        按编辑距离查找相近的指令名，用于纠正错别字（如 "签到打咔" -> "签到打卡"）
+        优先使用 rapidfuzz 的 C++ 实现，未安装时退回 difflib
+        
+        Args:
+            snapshot: 指令快照
+            keyword: 小写且不带 / 的关键词
+            limit: 最多返回的数量
+            cutoff: 最低相似度（0~1）
+        
+        Returns:
+            指令键列表，按相似度从高到低排序
+        """
+        name_list = snapshot.name_list
+        name_choices = snapshot.name_choices
+        if not name_choices:
+            return []
+        
+        if fuzz_process is not None:
+            matches = fuzz_process.extract(
+                keyword,
+                name_choices,
+                scorer=Levenshtein.normalized_similarity,
+                limit=limit,
+                score_cutoff=cutoff
+            )
+            return [name_list[index] for _, _, index in matches]
+        
+        matcher = difflib.SequenceMatcher(b=keyword)
+        scored = []
+        for index, choice in enumerate(name_choices):
+            matcher.set_seq1(choice)
+            score = matcher.ratio()
+            if score >= cutoff:
+                scored.append((score, index))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [name_list[index] for _, index in scored[:limit]]
+    
     def _should_refresh_cache(self) -> bool:
         """
         检查是否需要刷新缓存
@@ -99,30 +472,53 @@ class CommandQueryPlugin(Star):
             logger.error(f"检查缓存状态失败: {e}")
             return False
     
-    def _get_all_commands(self) -> Dict[str, Dict]:
+    def _get_snapshot(self) -> CommandSnapshot:
         """
-        获取所有指令信息并缓存
+        获取所有指令信息及搜索索引的快照并缓存
         优化版本：使用 Hash Map 索引，时间复杂度从 O(N²) 降到 O(N+M)
+        调用方每次只取一次快照，之后只读这个快照
         
-        返回格式: {
-            "/钓鱼": {
-                "command": "/钓鱼",
-                "description": "开始钓鱼游戏",
-                "plugin": "钓鱼游戏插件",
-                "aliases": ["/fishing", "/fish"]
-            }
+        快照中 commands 的格式: {
+            "/钓鱼": CommandInfo(
+                command="/钓鱼",
+                description="开始钓鱼游戏",
+                plugin="钓鱼游戏插件",
+                aliases=["fishing", "fish"],
+                ...  # 小写/替换前缀后的预计算字段
+            ),
+            "/fish": AliasView(
+                command="/fish",
+                is_alias_of="/钓鱼",
+                _base=CommandInfo(...)  # 指向 "/钓鱼" 的条目，描述、插件名等字段从这里读取
+            )
         }
         """
-        # 检查缓存是否有效
-        if self._command_cache is not None and not self._should_refresh_cache():
-            return self._command_cache
-        
-        # 缓存失效，重新构建
-        if self._command_cache is not None:
-            logger.info("插件已重载，重新构建指令缓存")
+        # 快速路径：缓存有效时直接返回，不加锁
+        snapshot = self._snapshot
+        if snapshot is not None and not self._should_refresh_cache():
+            return snapshot
         
-        self._command_cache = None
+        with self._build_lock:
+            # 双重检查：等锁期间其他调用方可能已经重建完成
+            current = self._snapshot
+            if current is not None and current is not snapshot:
+                return current
+            
+            # 缓存失效，重新构建
+            if current is not None:
+                logger.info("插件已重载，重新构建指令缓存")
+            
+            return self._build_commands()
+    
+    def _build_commands(self) -> CommandSnapshot:
+        """
+        重新构建指令缓存及搜索索引，调用方需持有 _build_lock
+        构建期间不清空旧快照：新的指令字典和索引都打包进新快照后，用一次赋值发布
+        已经取到旧快照的读取方继续读旧快照，之后的调用读新快照
         
+        Returns:
+            新的快照，格式见 _get_snapshot
+        """
         commands_dict = {}
         
         try:
@@ -131,11 +527,16 @@ class CommandQueryPlugin(Star):
             all_stars = [star for star in all_stars if star.activated]
         except Exception as e:
             logger.error(f"获取插件列表失败: {e}")
-            return {}
+            self._invalidate_cache()
+            return self._build_snapshot({})
         
         if not all_stars:
             logger.warning("没有找到任何激活的插件")
-            return {}
+            self._invalidate_cache()
+            return self._build_snapshot({})
+        
+        # 记录本次构建时的插件数量，避免下一次调用把刚建好的缓存判定为过期
+        self._last_star_count = len(all_stars)
         
         # 一次性构建 handler 索引 - O(M)
         handler_index = self._build_handler_index()
@@ -146,14 +547,17 @@ class CommandQueryPlugin(Star):
             module_path = getattr(star, "module_path", None)
             
             # 跳过核心插件和自身
-            if plugin_name in ["astrbot", "astrbot_plugin_command_query", "astrbot-reminder"]:
+            if plugin_name in _SKIP_PLUGINS:
                 continue
             
             if not module_path:
                 continue
             
+            # 同一插件的所有指令共用一份小写插件名
+            plugin_lower = plugin_name.lower()
+            
             # 直接从索引中获取该插件的 handlers - O(1)
-            handlers = handler_index.get(module_path, [])
+            handlers = handler_index.get(module_path, ())
             
             # 遍历该插件的 handlers
             for handler in handlers:
@@ -162,20 +566,21 @@ class CommandQueryPlugin(Star):
                 aliases = []
                 description = handler.desc or "无描述"
                 
-                # 查找命令过滤器
-                for filter_ in handler.event_filters:
-                    if isinstance(filter_, CommandFilter):
-                        command_name = filter_.command_name
-                        # 获取别名
-                        if hasattr(filter_, 'alias') and filter_.alias:
-                            if isinstance(filter_.alias, set):
-                                aliases = list(filter_.alias)
-                            elif isinstance(filter_.alias, list):
-                                aliases = filter_.alias
-                        break
-                    elif isinstance(filter_, CommandGroupFilter):
-                        command_name = filter_.group_name
-                        break
+                # 查找第一个命令过滤器，每个过滤器只做一次元组 isinstance 检查
+                filter_ = next(
+                    (f for f in handler.event_filters if isinstance(f, _COMMAND_FILTER_TYPES)),
+                    None
+                )
+                if isinstance(filter_, CommandFilter):
+                    command_name = filter_.command_name
+                    # 获取别名
+                    if hasattr(filter_, 'alias') and filter_.alias:
+                        if isinstance(filter_.alias, set):
+                            aliases = list(filter_.alias)
+                        elif isinstance(filter_.alias, list):
+                            aliases = filter_.alias
+                elif filter_ is not None:
+                    command_name = filter_.group_name
                 
                 # 如果找到了命令，添加到字典
                 if command_name:
@@ -183,84 +588,227 @@ class CommandQueryPlugin(Star):
                     if not command_name.startswith("/"):
                         command_name = "/" + command_name
                     
-                    command_info = {
-                        "command": command_name,
-                        "description": description,
-                        "plugin": plugin_name,
-                        "aliases": aliases
-                    }
+                    command_info = CommandInfo(
+                        command=command_name,
+                        description=description,
+                        plugin=plugin_name,
+                        aliases=aliases,
+                        _cmd_lower=command_name.lower(),
+                        _desc_lower=description.lower(),
+                        _plugin_lower=plugin_lower,
+                        _prefixed=self._replace_prefix(command_name),
+                        _aliases_prefixed=[self._replace_prefix(alias) for alias in aliases]
+                    )
                     
                     commands_dict[command_name] = command_info
                     
-                    # 为别名也建立索引
+                    # 为别名也建立索引，只保存别名自身的字段，其余字段通过 _base 共享
                     for alias in aliases:
                         if not alias.startswith("/"):
                             alias = "/" + alias
-                        commands_dict[alias] = {
-                            **command_info,
-                            "command": alias,
-                            "is_alias_of": command_name
-                        }
+                        commands_dict[alias] = AliasView(
+                            command_info, alias, self._replace_prefix(alias)
+                        )
         
-        self._command_cache = commands_dict
+        # 指令字典、索引和空的响应缓存打包为一个快照，一次赋值整体替换
+        snapshot = self._build_snapshot(commands_dict)
+        self._snapshot = snapshot
         logger.info(f"已缓存 {len(commands_dict)} 个指令（含别名）")
-        return commands_dict
+        return snapshot
 
-    def _search_similar_commands(self, keyword: str, limit: int = 5) -> List[Dict]:
+    def _search_similar_commands(
+        self,
+        snapshot: CommandSnapshot,
+        keyword: str,
+        limit: int = 5,
+        project: Optional[Callable[[CommandEntry], Dict]] = None
+    ) -> List:
         """
         搜索相似的指令
-        支持模糊匹配、拼音匹配等
+        支持前缀匹配、分词匹配、子串匹配、编辑距离纠错
+        纠错类的匹配排在所有子串匹配之后，只用来填补剩余的名额
+        短关键词只在其他匹配都落空时纠错，多个词的关键词不纠错
+        
+        Args:
+            snapshot: 指令快照，整次搜索只读这一个快照
+            keyword: 搜索关键词
+            limit: 最多返回的数量
+            project: 可选的投影函数，命中时直接转换为最终的返回结构，避免二次遍历
+        
+        Returns:
+            命中的指令条目（或其投影结果）列表
         """
-        all_commands = self._get_all_commands()
+        all_commands = snapshot.commands
         keyword_lower = keyword.lower().strip()
         
         # 移除开头的 /
         if keyword_lower.startswith("/"):
             keyword_lower = keyword_lower[1:]
         
+        if project is None:
+            project = _identity
+        
         results = []
+        # 按原指令去重：别名与原指令只保留先命中的那一条
+        seen_keys = set()
         
         # 1. 精确匹配
         exact_match = f"/{keyword_lower}"
         if exact_match in all_commands:
-            results.append(all_commands[exact_match])
+            cmd_info = all_commands[exact_match]
+            results.append(project(cmd_info))
+            seen_keys.add(cmd_info.is_alias_of if isinstance(cmd_info, AliasView) else exact_match)
+        
+        # 每一层凑够 limit 条即返回，不再继续扫描
+        if len(results) >= limit:
+            return results
+        
+        # 2. 前缀匹配 - 前缀树 O(|keyword|)
+        for cmd_key in self._trie_prefix_match(snapshot, keyword_lower):
+            cmd_info = all_commands[cmd_key]
+            canonical = cmd_info.is_alias_of if isinstance(cmd_info, AliasView) else cmd_key
+            if canonical not in seen_keys:
+                seen_keys.add(canonical)
+                results.append(project(cmd_info))
+                if len(results) >= limit:
+                    return results
+        
+        # 3. 分词匹配 - 倒排索引 O(1)，多个词时取各词命中集合的交集（AND）
+        for cmd_key in sorted(self._match_tokens(snapshot, keyword_lower), key=snapshot.key_order.__getitem__):
+            cmd_info = all_commands[cmd_key]
+            canonical = cmd_info.is_alias_of if isinstance(cmd_info, AliasView) else cmd_key
+            if canonical not in seen_keys:
+                seen_keys.add(canonical)
+                results.append(project(cmd_info))
+                if len(results) >= limit:
+                    return results
         
-        # 2. 模糊匹配 - 命令名包含关键词
-        for cmd_name, cmd_info in all_commands.items():
-            if cmd_info in results:
+        # 以下为子串兜底匹配（中文描述通常无法按空白分词）
+        # 先用 3 字片段索引缩小范围，关键词过短时退回全量扫描
+        candidates = self._substring_candidates(snapshot, keyword_lower)
+        candidate_rows = all_commands.values() if candidates is None else candidates
+        
+        # 命令名/描述/插件名三层子串匹配合并为一次遍历，按层分别收集，再按优先级输出
+        name_hits = []  # (原指令键, 条目)
+        name_hit_keys = set()
+        desc_hits = []
+        plugin_hits = []
+        for cmd_info in candidate_rows:
+            is_alias = isinstance(cmd_info, AliasView)
+            canonical = cmd_info.is_alias_of if is_alias else cmd_info.command
+            if canonical in seen_keys:
                 continue
             
-            cmd_name_lower = cmd_name.lower()
-            if keyword_lower in cmd_name_lower:
-                results.append(cmd_info)
-        
-        # 3. 描述匹配 - 描述包含关键词
-        if len(results) < limit:
-            for cmd_info in all_commands.values():
-                if cmd_info in results:
+            if keyword_lower in cmd_info._cmd_lower:
+                if canonical not in name_hit_keys:
+                    name_hit_keys.add(canonical)
+                    name_hits.append((canonical, cmd_info))
+                    # 命令名命中已经凑够，后面的描述/插件名命中用不上
+                    if len(results) + len(name_hits) >= limit:
+                        break
+            elif not is_alias:
+                # 别名与原指令共享描述和插件名，故只需检查原指令
+                if keyword_lower in cmd_info._desc_lower:
+                    desc_hits.append(cmd_info)
+                elif keyword_lower in cmd_info._plugin_lower:
+                    plugin_hits.append(cmd_info)
+        
+        # 4. 模糊匹配 - 命令名包含关键词
+        for canonical, cmd_info in name_hits:
+            results.append(project(cmd_info))
+            seen_keys.add(canonical)
+        if len(results) >= limit:
+            return results
+        
+        # 5. 描述匹配 - 描述包含关键词
+        # 6. 插件名匹配
+        for hits in (desc_hits, plugin_hits):
+            for cmd_info in hits:
+                if cmd_info.command in seen_keys:
                     continue
                 
-                desc_lower = cmd_info["description"].lower()
-                if keyword_lower in desc_lower:
-                    results.append(cmd_info)
-                
+                results.append(project(cmd_info))
+                seen_keys.add(cmd_info.command)
                 if len(results) >= limit:
-                    break
+                    return results
         
-        # 4. 插件名匹配
-        if len(results) < limit:
-            for cmd_info in all_commands.values():
-                if cmd_info in results:
-                    continue
-                
-                plugin_lower = cmd_info["plugin"].lower()
-                if keyword_lower in plugin_lower:
-                    results.append(cmd_info)
-                
+        # 7. 编辑距离匹配 - 纠正错别字
+        # 多个词的关键词（如 "fish bag"）不是打错的指令名，不做纠错
+        if len([token for token in _TOKEN_SPLIT.split(keyword_lower) if token]) > 1:
+            return results
+        if len(keyword_lower) >= _FUZZY_MIN_LEN:
+            cutoff = _FUZZY_CUTOFF
+        elif not results:
+            # 短关键词（如 "钩鱼"）前面各层都没有命中时才纠错
+            cutoff = _FUZZY_SHORT_CUTOFF
+        else:
+            return results
+        
+        for cmd_key in self._fuzzy_name_match(snapshot, keyword_lower, limit, cutoff):
+            cmd_info = all_commands[cmd_key]
+            canonical = cmd_info.is_alias_of if isinstance(cmd_info, AliasView) else cmd_key
+            if canonical not in seen_keys:
+                seen_keys.add(canonical)
+                results.append(project(cmd_info))
                 if len(results) >= limit:
-                    break
+                    return results
         
-        return results[:limit]
+        return results
+
+    def _project_search_result(self, cmd_info: CommandEntry) -> Dict:
+        """
+        将缓存中的指令条目转换为 search_command 的返回结构
+        移除内部字段，并替换前缀
+        
+        Args:
+            cmd_info: 指令缓存中的条目（可能是别名条目）
+        
+        Returns:
+            只含对外字段的新字典
+        """
+        # 别名条目只保存自身字段，共享字段从原指令读取
+        is_alias = isinstance(cmd_info, AliasView)
+        base = cmd_info._base if is_alias else cmd_info
+        clean_result = {
+            "command": cmd_info._prefixed,
+            "description": base.description,
+            "plugin": base.plugin,
+            "aliases": base._aliases_prefixed
+        }
+        if is_alias:
+            clean_result["is_alias_of"] = base._prefixed
+        return clean_result
+    
+    def _search_command_impl(self, snapshot: CommandSnapshot, keyword: str) -> Dict:
+        """
+        search_command 的实现，返回未序列化的响应数据
+        测试指令直接调用此方法，避免 JSON 序列化再解析
+        
+        Args:
+            snapshot: 调用方取到的指令快照
+            keyword: 搜索关键词
+        
+        Returns:
+            与 search_command 返回的 JSON 结构相同的字典
+        """
+        # 命中时直接投影为返回结构，不再单独清理一遍
+        clean_results = self._search_similar_commands(
+            snapshot, keyword, limit=5, project=self._project_search_result
+        )
+        
+        if not clean_results:
+            return {
+                "success": False,
+                "message": f"未找到与 '{keyword}' 相关的指令",
+                "results": []
+            }
+        
+        logger.info(f"找到 {len(clean_results)} 条相关指令")
+        return {
+            "success": True,
+            "message": f"找到 {len(clean_results)} 条与 '{keyword}' 相关的指令",
+            "results": clean_results
+        }
 
     @filter.llm_tool(name="search_command")
     async def search_command(self, event: AstrMessageEvent, **kwargs) -> str:
@@ -291,50 +839,89 @@ class CommandQueryPlugin(Star):
         try:
             keyword = kwargs.get('keyword', '')
             if not keyword:
-                return json.dumps({
-                    "success": False,
-                    "message": "缺少必需参数: keyword",
-                    "results": []
-                }, ensure_ascii=False, indent=2)
+                return _ERR_NO_KEYWORD
             
             logger.info(f"LLM搜索指令: {keyword}")
             
-            results = self._search_similar_commands(keyword, limit=5)
-            
-            if not results:
-                return json.dumps({
-                    "success": False,
-                    "message": f"未找到与 '{keyword}' 相关的指令",
-                    "results": []
-                }, ensure_ascii=False, indent=2)
-            
-            # 清理结果，移除内部字段，并替换前缀
-            clean_results = []
-            for result in results:
-                clean_result = {
-                    "command": self._replace_prefix(result["command"]),
-                    "description": result["description"],
-                    "plugin": result["plugin"],
-                    "aliases": [self._replace_prefix(alias) for alias in result["aliases"]]
-                }
-                if "is_alias_of" in result:
-                    clean_result["is_alias_of"] = self._replace_prefix(result["is_alias_of"])
-                clean_results.append(clean_result)
-            
-            logger.info(f"找到 {len(clean_results)} 条相关指令")
-            return json.dumps({
-                "success": True,
-                "message": f"找到 {len(clean_results)} 条与 '{keyword}' 相关的指令",
-                "results": clean_results
-            }, ensure_ascii=False, indent=2)
+            # 同一快照内，同一关键词的搜索结果不会变化；只取一次快照，查缓存和生成响应都用它
+            snapshot = self._get_snapshot()
+            cache = snapshot.search_response_cache
+            cached = cache.get(keyword)
+            if cached is not None:
+                cache.move_to_end(keyword)
+                return cached
             
+            result = self._search_command_impl(snapshot, keyword)
+            response = _dumps(result)
+            if result["success"]:
+                cache[keyword] = response
+                if len(cache) > _SEARCH_CACHE_SIZE:
+                    cache.popitem(last=False)
+            return response
+        
         except Exception as e:
             logger.error(f"搜索指令时发生错误: {e}")
-            return json.dumps({
+            return _dumps({
                 "success": False,
                 "message": f"搜索失败: {str(e)}",
                 "results": []
-            }, ensure_ascii=False, indent=2)
+            })
+
+    def _get_command_detail_impl(self, snapshot: CommandSnapshot, command_name: str) -> Dict:
+        """
+        get_command_detail 的实现，返回未序列化的响应数据
+        
+        Args:
+            snapshot: 调用方取到的指令快照
+            command_name: 指令名（可带或不带 /）
+        
+        Returns:
+            与 get_command_detail 返回的 JSON 结构相同的字典
+        """
+        # 标准化指令名
+        if not command_name.startswith("/"):
+            command_name = "/" + command_name
+        
+        all_commands = snapshot.commands
+        
+        # 查找指令
+        if command_name not in all_commands:
+            # 尝试搜索相似指令
+            similar = self._search_similar_commands(snapshot, command_name, limit=3)
+            return {
+                "success": False,
+                "message": f"未找到指令 '{command_name}'",
+                "suggestions": [cmd._prefixed for cmd in similar]
+            }
+        
+        cmd_info = all_commands[command_name]
+        # 别名条目只保存自身字段，共享字段从原指令读取
+        is_alias = isinstance(cmd_info, AliasView)
+        base = cmd_info._base if is_alias else cmd_info
+        
+        # 查找同插件的其他指令（相关推荐），插件索引中已不含别名
+        similar_commands = []
+        for cmd_data in snapshot.plugins_index.get(base.plugin, ()):
+            if cmd_data.command != command_name:
+                similar_commands.append(cmd_data._prefixed)
+                if len(similar_commands) >= 3:
+                    break
+        
+        result = {
+            "success": True,
+            "command": cmd_info._prefixed,
+            "description": base.description,
+            "plugin": base.plugin,
+            "aliases": base._aliases_prefixed,
+            "similar_commands": similar_commands
+        }
+        
+        if is_alias:
+            result["is_alias_of"] = base._prefixed
+            result["note"] = f"这是 {base._prefixed} 的别名"
+        
+        logger.info(f"成功获取指令详情: {command_name}")
+        return result
 
     @filter.llm_tool(name="get_command_detail")
     async def get_command_detail(self, event: AstrMessageEvent, **kwargs) -> str:
@@ -365,64 +952,83 @@ class CommandQueryPlugin(Star):
         try:
             command_name = kwargs.get('command_name', '')
             if not command_name:
-                return json.dumps({
-                    "success": False,
-                    "message": "缺少必需参数: command_name"
-                }, ensure_ascii=False, indent=2)
+                return _ERR_NO_COMMAND
             
             logger.info(f"LLM查询指令详情: {command_name}")
             
-            # 标准化指令名
-            if not command_name.startswith("/"):
-                command_name = "/" + command_name
-            
-            all_commands = self._get_all_commands()
-            
-            # 查找指令
-            if command_name not in all_commands:
-                # 尝试搜索相似指令
-                similar = self._search_similar_commands(command_name, limit=3)
-                return json.dumps({
-                    "success": False,
-                    "message": f"未找到指令 '{command_name}'",
-                    "suggestions": [cmd["command"] for cmd in similar]
-                }, ensure_ascii=False, indent=2)
-            
-            cmd_info = all_commands[command_name]
-            
-            # 查找同插件的其他指令（相关推荐）
-            plugin_name = cmd_info["plugin"]
-            similar_commands = []
-            for cmd_name, cmd_data in all_commands.items():
-                if cmd_data["plugin"] == plugin_name and cmd_name != command_name:
-                    # 跳过别名
-                    if "is_alias_of" not in cmd_data:
-                        similar_commands.append(cmd_name)
-                        if len(similar_commands) >= 3:
-                            break
-            
-            result = {
-                "success": True,
-                "command": self._replace_prefix(cmd_info["command"]),
-                "description": cmd_info["description"],
-                "plugin": cmd_info["plugin"],
-                "aliases": [self._replace_prefix(alias) for alias in cmd_info["aliases"]],
-                "similar_commands": [self._replace_prefix(cmd) for cmd in similar_commands]
-            }
-            
-            if "is_alias_of" in cmd_info:
-                result["is_alias_of"] = self._replace_prefix(cmd_info["is_alias_of"])
-                result["note"] = f"这是 {self._replace_prefix(cmd_info['is_alias_of'])} 的别名"
-            
-            logger.info(f"成功获取指令详情: {command_name}")
-            return json.dumps(result, ensure_ascii=False, indent=2)
+            # 同一快照内，同一指令的详情不会变化；只取一次快照，查缓存和生成响应都用它
+            snapshot = self._get_snapshot()
+            response_cache = snapshot.response_cache
+            cache_key = ("get_command_detail", command_name)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return cached
             
+            result = self._get_command_detail_impl(snapshot, command_name)
+            response = _dumps(result)
+            if result["success"]:
+                response_cache[cache_key] = response
+            return response
+        
         except Exception as e:
             logger.error(f"查询指令详情时发生错误: {e}")
-            return json.dumps({
+            return _dumps({
                 "success": False,
                 "message": f"查询失败: {str(e)}"
-            }, ensure_ascii=False, indent=2)
+            })
+
+    def _list_plugin_commands_impl(self, snapshot: CommandSnapshot, plugin_name: str) -> Dict:
+        """
+        list_plugin_commands 的实现，返回未序列化的响应数据
+        
+        Args:
+            snapshot: 调用方取到的指令快照
+            plugin_name: 插件名关键词，为空时列出所有插件
+        
+        Returns:
+            与 list_plugin_commands 返回的 JSON 结构相同的字典
+        """
+        plugins_index = snapshot.plugins_index
+        
+        # 如果没有指定插件名，返回所有插件列表
+        if not plugin_name:
+            plugin_list = snapshot.plugin_names_sorted
+            return {
+                "success": True,
+                "message": f"系统共有 {len(plugin_list)} 个插件",
+                "plugins": plugin_list,
+                "hint": "使用 list_plugin_commands 并指定 plugin_name 参数查看具体插件的指令"
+            }
+        
+        # 搜索匹配的插件（支持模糊匹配）
+        matched_plugin = self._match_plugin(snapshot, plugin_name)
+        
+        if not matched_plugin:
+            return {
+                "success": False,
+                "message": f"未找到插件 '{plugin_name}'",
+                "available_plugins": snapshot.plugin_names_sorted
+            }
+        
+        # 获取该插件的所有指令
+        commands = plugins_index[matched_plugin]
+        
+        result = {
+            "success": True,
+            "plugin": matched_plugin,
+            "command_count": len(commands),
+            "commands": [
+                {
+                    "command": cmd._prefixed,
+                    "description": cmd.description,
+                    "aliases": cmd._aliases_prefixed
+                }
+                for cmd in commands
+            ]
+        }
+        
+        logger.info(f"找到插件 '{matched_plugin}' 的 {len(commands)} 条指令")
+        return result
 
     @filter.llm_tool(name="list_plugin_commands")
     async def list_plugin_commands(self, event: AstrMessageEvent, **kwargs) -> str:
@@ -459,239 +1065,196 @@ class CommandQueryPlugin(Star):
             plugin_name = kwargs.get('plugin_name', '')
             logger.info(f"LLM查询插件指令: {plugin_name or '所有插件'}")
             
-            all_commands = self._get_all_commands()
-            
-            # 按插件分组
-            plugins_dict = collections.defaultdict(list)
-            for cmd_info in all_commands.values():
-                # 跳过别名
-                if "is_alias_of" not in cmd_info:
-                    plugins_dict[cmd_info["plugin"]].append(cmd_info)
-            
-            # 如果没有指定插件名，返回所有插件列表
-            if not plugin_name:
-                plugin_list = sorted(plugins_dict.keys())
-                return json.dumps({
-                    "success": True,
-                    "message": f"系统共有 {len(plugin_list)} 个插件",
-                    "plugins": plugin_list,
-                    "hint": "使用 list_plugin_commands 并指定 plugin_name 参数查看具体插件的指令"
-                }, ensure_ascii=False, indent=2)
-            
-            # 搜索匹配的插件（支持模糊匹配）
-            plugin_name_lower = plugin_name.lower()
-            matched_plugin = None
-            for pname in plugins_dict.keys():
-                if plugin_name_lower in pname.lower():
-                    matched_plugin = pname
-                    break
-            
-            if not matched_plugin:
-                return json.dumps({
-                    "success": False,
-                    "message": f"未找到插件 '{plugin_name}'",
-                    "available_plugins": sorted(plugins_dict.keys())
-                }, ensure_ascii=False, indent=2)
-            
-            # 获取该插件的所有指令
-            commands = plugins_dict[matched_plugin]
-            
-            result = {
-                "success": True,
-                "plugin": matched_plugin,
-                "command_count": len(commands),
-                "commands": [
-                    {
-                        "command": self._replace_prefix(cmd["command"]),
-                        "description": cmd["description"],
-                        "aliases": [self._replace_prefix(alias) for alias in cmd["aliases"]]
-                    }
-                    for cmd in commands
-                ]
-            }
-            
-            logger.info(f"找到插件 '{matched_plugin}' 的 {len(commands)} 条指令")
-            return json.dumps(result, ensure_ascii=False, indent=2)
+            # 同一快照内，同一查询的结果不会变化；只取一次快照，查缓存和生成响应都用它
+            snapshot = self._get_snapshot()
+            response_cache = snapshot.response_cache
+            cache_key = ("list_plugin_commands", plugin_name)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return cached
             
+            result = self._list_plugin_commands_impl(snapshot, plugin_name)
+            response = _dumps(result)
+            if result["success"]:
+                response_cache[cache_key] = response
+            return response
+        
         except Exception as e:
             logger.error(f"查询插件指令时发生错误: {e}")
-            return json.dumps({
+            return _dumps({
                 "success": False,
                 "message": f"查询失败: {str(e)}"
-            }, ensure_ascii=False, indent=2)
+            })
 
     @filter.command("测试指令搜索", alias={"test_search"})
     async def test_search(self, event: AstrMessageEvent) -> AsyncGenerator[MessageEventResult, None]:
         """测试指令：搜索指令功能"""
         # 从消息中提取关键词
-        message = event.message_str.replace("/测试指令搜索", "").replace("/test_search", "").strip()
+        message = _STRIP_SEARCH.sub("", event.message_str, count=1).strip()
         
         if not message:
             yield event.plain_result("用法: /测试指令搜索 <关键词>\n例如: /测试指令搜索 钓鱼")
             return
         
         logger.info(f"测试搜索指令: {message}")
-        result_str = await self.search_command(event, message)
-        
         try:
-            result_data = json.loads(result_str)
-            
-            if not result_data.get("success"):
-                yield event.plain_result(f"❌ {result_data.get('message', '搜索失败')}")
-                return
-            
-            results = result_data.get("results", [])
-            if not results:
-                yield event.plain_result(f"未找到与 '{message}' 相关的指令")
-                return
-            
-            result_text = f"🔍 搜索 '{message}' 的结果：\n\n"
-            for i, cmd in enumerate(results, 1):
-                result_text += f"{i}. {cmd['command']}\n"
-                result_text += f"   📦 插件: {cmd['plugin']}\n"
-                result_text += f"   📝 描述: {cmd['description']}\n"
-                if cmd.get('aliases'):
-                    result_text += f"   🔗 别名: {', '.join(cmd['aliases'])}\n"
-                if cmd.get('is_alias_of'):
-                    result_text += f"   ℹ️  这是 {cmd['is_alias_of']} 的别名\n"
-                result_text += "\n"
-            
-            yield event.plain_result(result_text.strip())
-            
-        except json.JSONDecodeError:
-            yield event.plain_result(f"数据解析失败：\n{result_str}")
+            result_data = self._search_command_impl(self._get_snapshot(), message)
+        except Exception as e:
+            logger.error(f"搜索指令时发生错误: {e}")
+            yield event.plain_result(f"❌ 搜索失败: {str(e)}")
+            return
+        
+        if not result_data.get("success"):
+            yield event.plain_result(f"❌ {result_data.get('message', '搜索失败')}")
+            return
+        
+        results = result_data.get("results", [])
+        if not results:
+            yield event.plain_result(f"未找到与 '{message}' 相关的指令")
+            return
+        
+        parts = [f"🔍 搜索 '{message}' 的结果：\n\n"]
+        for i, cmd in enumerate(results, 1):
+            parts.append(f"{i}. {cmd['command']}\n")
+            parts.append(f"   📦 插件: {cmd['plugin']}\n")
+            parts.append(f"   📝 描述: {cmd['description']}\n")
+            if cmd.get('aliases'):
+                parts.append(f"   🔗 别名: {', '.join(cmd['aliases'])}\n")
+            if cmd.get('is_alias_of'):
+                parts.append(f"   ℹ️  这是 {cmd['is_alias_of']} 的别名\n")
+            parts.append("\n")
+        
+        yield event.plain_result("".join(parts).strip())
 
     @filter.command("测试指令详情", alias={"test_detail"})
     async def test_detail(self, event: AstrMessageEvent) -> AsyncGenerator[MessageEventResult, None]:
         """测试指令：查询指令详情"""
-        message = event.message_str.replace("/测试指令详情", "").replace("/test_detail", "").strip()
+        message = _STRIP_DETAIL.sub("", event.message_str, count=1).strip()
         
         if not message:
             yield event.plain_result("用法: /测试指令详情 <指令名>\n例如: /测试指令详情 钓鱼")
             return
         
         logger.info(f"测试查询指令详情: {message}")
-        result_str = await self.get_command_detail(event, message)
-        
         try:
-            result_data = json.loads(result_str)
-            
-            if not result_data.get("success"):
-                msg = result_data.get('message', '查询失败')
-                suggestions = result_data.get('suggestions', [])
-                result_text = f"❌ {msg}\n"
-                if suggestions:
-                    result_text += f"\n💡 你可能想找：\n"
-                    for cmd in suggestions:
-                        result_text += f"  • {cmd}\n"
-                yield event.plain_result(result_text.strip())
-                return
-            
-            result_text = f"📋 指令详情\n\n"
-            result_text += f"🎯 指令: {result_data['command']}\n"
-            result_text += f"📦 插件: {result_data['plugin']}\n"
-            result_text += f"📝 描述: {result_data['description']}\n"
-            
-            if result_data.get('aliases'):
-                result_text += f"🔗 别名: {', '.join(result_data['aliases'])}\n"
-            
-            if result_data.get('is_alias_of'):
-                result_text += f"\nℹ️  {result_data.get('note', '')}\n"
-            
-            if result_data.get('similar_commands'):
-                result_text += f"\n💡 相关指令:\n"
-                for cmd in result_data['similar_commands']:
-                    result_text += f"  • {cmd}\n"
-            
-            yield event.plain_result(result_text.strip())
-            
-        except json.JSONDecodeError:
-            yield event.plain_result(f"数据解析失败：\n{result_str}")
+            result_data = self._get_command_detail_impl(self._get_snapshot(), message)
+        except Exception as e:
+            logger.error(f"查询指令详情时发生错误: {e}")
+            yield event.plain_result(f"❌ 查询失败: {str(e)}")
+            return
+        
+        if not result_data.get("success"):
+            msg = result_data.get('message', '查询失败')
+            suggestions = result_data.get('suggestions', [])
+            parts = [f"❌ {msg}\n"]
+            if suggestions:
+                parts.append(f"\n💡 你可能想找：\n")
+                for cmd in suggestions:
+                    parts.append(f"  • {cmd}\n")
+            yield event.plain_result("".join(parts).strip())
+            return
+        
+        parts = [f"📋 指令详情\n\n"]
+        parts.append(f"🎯 指令: {result_data['command']}\n")
+        parts.append(f"📦 插件: {result_data['plugin']}\n")
+        parts.append(f"📝 描述: {result_data['description']}\n")
+        
+        if result_data.get('aliases'):
+            parts.append(f"🔗 别名: {', '.join(result_data['aliases'])}\n")
+        
+        if result_data.get('is_alias_of'):
+            parts.append(f"\nℹ️  {result_data.get('note', '')}\n")
+        
+        if result_data.get('similar_commands'):
+            parts.append(f"\n💡 相关指令:\n")
+            for cmd in result_data['similar_commands']:
+                parts.append(f"  • {cmd}\n")
+        
+        yield event.plain_result("".join(parts).strip())
 
     @filter.command("测试插件列表", alias={"test_plugins"})
     async def test_plugins(self, event: AstrMessageEvent) -> AsyncGenerator[MessageEventResult, None]:
         """测试指令：查看插件列表或插件的指令"""
-        message = event.message_str.replace("/测试插件列表", "").replace("/test_plugins", "").strip()
+        message = _STRIP_PLUGINS.sub("", event.message_str, count=1).strip()
         
         logger.info(f"测试查询插件: {message or '所有插件'}")
-        result_str = await self.list_plugin_commands(event, message)
-        
         try:
-            result_data = json.loads(result_str)
-            
-            if not result_data.get("success"):
-                msg = result_data.get('message', '查询失败')
-                result_text = f"❌ {msg}\n"
-                
-                available = result_data.get('available_plugins', [])
-                if available:
-                    result_text += f"\n可用插件列表：\n"
-                    for plugin in available[:10]:
-                        result_text += f"  • {plugin}\n"
-                    if len(available) > 10:
-                        result_text += f"  ... 还有 {len(available) - 10} 个插件\n"
-                
-                yield event.plain_result(result_text.strip())
-                return
-            
-            # 如果是插件列表
-            if "plugins" in result_data:
-                plugins = result_data["plugins"]
-                result_text = f"📦 系统插件列表 ({len(plugins)} 个)\n\n"
-                for plugin in plugins[:20]:
-                    result_text += f"  • {plugin}\n"
-                if len(plugins) > 20:
-                    result_text += f"\n... 还有 {len(plugins) - 20} 个插件\n"
-                result_text += f"\n💡 使用 /测试插件列表 <插件名> 查看插件的指令"
-                yield event.plain_result(result_text.strip())
-                return
-            
-            # 如果是插件的指令列表
-            plugin = result_data.get("plugin", "")
-            commands = result_data.get("commands", [])
-            
-            result_text = f"📦 {plugin}\n"
-            result_text += f"共 {len(commands)} 条指令\n\n"
-            
-            for cmd in commands:
-                result_text += f"• {cmd['command']}\n"
-                result_text += f"  {cmd['description']}\n"
-                if cmd.get('aliases'):
-                    result_text += f"  别名: {', '.join(cmd['aliases'])}\n"
-                result_text += "\n"
+            result_data = self._list_plugin_commands_impl(self._get_snapshot(), message)
+        except Exception as e:
+            logger.error(f"查询插件指令时发生错误: {e}")
+            yield event.plain_result(f"❌ 查询失败: {str(e)}")
+            return
+        
+        if not result_data.get("success"):
+            msg = result_data.get('message', '查询失败')
+            parts = [f"❌ {msg}\n"]
             
-            yield event.plain_result(result_text.strip())
+            available = result_data.get('available_plugins', [])
+            if available:
+                parts.append(f"\n可用插件列表：\n")
+                for plugin in available[:10]:
+                    parts.append(f"  • {plugin}\n")
+                if len(available) > 10:
+                    parts.append(f"  ... 还有 {len(available) - 10} 个插件\n")
             
-        except json.JSONDecodeError:
-            yield event.plain_result(f"数据解析失败：\n{result_str}")
+            yield event.plain_result("".join(parts).strip())
+            return
+        
+        # 如果是插件列表
+        if "plugins" in result_data:
+            plugins = result_data["plugins"]
+            parts = [f"📦 系统插件列表 ({len(plugins)} 个)\n\n"]
+            for plugin in plugins[:20]:
+                parts.append(f"  • {plugin}\n")
+            if len(plugins) > 20:
+                parts.append(f"\n... 还有 {len(plugins) - 20} 个插件\n")
+            parts.append(f"\n💡 使用 /测试插件列表 <插件名> 查看插件的指令")
+            yield event.plain_result("".join(parts).strip())
+            return
+        
+        # 如果是插件的指令列表
+        plugin = result_data.get("plugin", "")
+        commands = result_data.get("commands", [])
+        
+        parts = [f"📦 {plugin}\n"]
+        parts.append(f"共 {len(commands)} 条指令\n\n")
+        
+        for cmd in commands:
+            parts.append(f"• {cmd['command']}\n")
+            parts.append(f"  {cmd['description']}\n")
+            if cmd.get('aliases'):
+                parts.append(f"  别名: {', '.join(cmd['aliases'])}\n")
+            parts.append("\n")
+        
+        yield event.plain_result("".join(parts).strip())
 
     @filter.command("刷新指令缓存", alias={"refresh_cache"})
     async def refresh_cache(self, event: AstrMessageEvent) -> AsyncGenerator[MessageEventResult, None]:
         """手动刷新指令缓存 - 热加载插件后使用"""
-        old_count = len(self._command_cache) if self._command_cache else 0
-        
-        # 强制刷新缓存
-        self._command_cache = None
-        self._last_star_count = 0  # 重置计数器，强制重建
+        old_snapshot = self._snapshot
+        old_count = len(old_snapshot.commands) if old_snapshot is not None else 0
         
-        new_commands = self._get_all_commands()
-        new_count = len(new_commands)
+        # 强制重建，不先清空缓存，重建期间其他调用方仍读取完整的旧快照
+        with self._build_lock:
+            new_snapshot = self._build_commands()
+        new_count = len(new_snapshot.commands)
         
         # 统计实际指令数（不含别名）
-        real_commands = [cmd for cmd in new_commands.values() if "is_alias_of" not in cmd]
-        real_count = len(real_commands)
+        real_count = len(new_snapshot.canonical_commands)
         alias_count = new_count - real_count
         
-        result_text = f"✅ 指令缓存已刷新\n\n"
-        result_text += f"📊 统计信息：\n"
-        result_text += f"  原有指令：{old_count} 条（含别名）\n"
-        result_text += f"  当前指令：{new_count} 条（含别名）\n"
-        result_text += f"  实际指令：{real_count} 条\n"
-        result_text += f"  别名数量：{alias_count} 条\n"
-        result_text += f"  变化量：{new_count - old_count:+d} 条\n\n"
-        result_text += f"💡 提示：系统会自动检测插件变化并刷新缓存"
+        parts = [
+            "✅ 指令缓存已刷新\n\n",
+            "📊 统计信息：\n",
+            f"  原有指令：{old_count} 条（含别名）\n",
+            f"  当前指令：{new_count} 条（含别名）\n",
+            f"  实际指令：{real_count} 条\n",
+            f"  别名数量：{alias_count} 条\n",
+            f"  变化量：{new_count - old_count:+d} 条\n\n",
+            "💡 提示：系统会自动检测插件变化并刷新缓存"
+        ]
         
-        yield event.plain_result(result_text)
+        yield event.plain_result("".join(parts))
     
     @filter.command("指令查询帮助", alias={"query_help"})
     async def help_command(self, event: AstrMessageEvent) -> AsyncGenerator[MessageEventResult, None]: